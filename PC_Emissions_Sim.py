@@ -1,8 +1,95 @@
 #Intermittent Bleed Pneumatic Controller Simulator v1.0
 
 import numpy as np
+from numba import njit
 
-def simulate_emissions_optimized(PC_count, DTF, S0, timesteps, p_gas, S1, p, r, prop_rates, malf_rates):
+# Above this max(p, r) the jitted loop visits every PC each step instead of only flip candidates
+SPARSE_MAX_THRESHOLD = 0.1
+
+
+@njit(cache=True)
+def _simulate_core(next_double, bitgen_state, states, prop_sample, malf_sample, p, r, timesteps, full_output,
+                   sum_emission_rate, emission_rates_each, state_history, state_history_each):
+    # Jitted Markov loop: records each step's states/emissions, then transitions PCs in place.
+    # Per-PC histories are only written when full_output is set; otherwise they may be empty.
+    # Uniforms come straight from a NumPy bit generator via its ctypes next_double(state) pointer.
+    PC_count = states.shape[0]
+
+    # Flip threshold is p + s * (r - p): p for state 0, r for state 1
+    thresh_step = r - p
+
+    # Only PCs whose draw falls under max_thr = max(p, r) can flip. Those candidates are visited
+    # directly by sampling the geometric gaps between them, and each one flips with probability
+    # threshold / max_thr, which is exact and costs O(#candidates) per step instead of O(PC_count).
+    # With p == r == 0 nothing can ever flip and the transition is skipped outright.
+    max_thr = max(p, r)
+    log_keep = np.log1p(-max_thr) if max_thr < 1 else -np.inf
+
+    # Running count of properly operating PCs, updated only by the PCs that flip
+    n0 = PC_count - np.sum(states)
+
+    if max_thr >= SPARSE_MAX_THRESHOLD:
+        # Most PCs are candidates anyway: one draw per PC, fused with the recording pass, is cheaper
+        # than a log per candidate
+        for t in range(timesteps):
+            state_history[t, 0] = n0 / PC_count
+            state_history[t, 1] = (PC_count - n0) / PC_count
+
+            step_sum = 0.0
+            for i in range(PC_count):
+                s = states[i]
+                emission = prop_sample[i] if s == 0 else malf_sample[i]
+                step_sum += emission
+                if full_output:
+                    state_history_each[t, i] = s
+                    emission_rates_each[t, i] = emission
+
+                # Branchless transition: 0 -> 1 with probability p, 1 -> 0 with probability r
+                flip = next_double(bitgen_state) < p + s * thresh_step
+                states[i] = s ^ flip
+                n0 += flip * (2 * s - 1)
+
+            sum_emission_rate[t] = step_sum
+        return
+
+    # Running total emission rate, likewise updated only by the PCs that flip
+    step_sum = 0.0
+    for i in range(PC_count):
+        step_sum += prop_sample[i] if states[i] == 0 else malf_sample[i]
+
+    for t in range(timesteps):
+        state_history[t, 0] = n0 / PC_count
+        state_history[t, 1] = (PC_count - n0) / PC_count
+        sum_emission_rate[t] = step_sum
+
+        if full_output:
+            for i in range(PC_count):
+                s = states[i]
+                state_history_each[t, i] = s
+                emission_rates_each[t, i] = prop_sample[i] if s == 0 else malf_sample[i]
+
+        if max_thr == 0:
+            continue
+
+        i = -1
+        while True:
+            # Non-candidates skipped before the next candidate
+            gap = np.log(1.0 - next_double(bitgen_state)) / log_keep
+            if gap >= PC_count - 1 - i:
+                break
+            i += 1 + int(gap)
+
+            s = states[i]
+            if next_double(bitgen_state) * max_thr < p + s * thresh_step:
+                states[i] = s ^ 1
+                n0 += 2 * s - 1
+                step_sum += (prop_sample[i] - malf_sample[i]) if s == 1 else (malf_sample[i] - prop_sample[i])
+
+
+def simulate_emissions_optimized(PC_count, DTF, S0, timesteps, p_gas, S1, p, r, prop_rates, malf_rates, rng=None,
+                                 full_output=True):
+    # With full_output=False the per-PC histories (emission_rates_each, state_history_each)
+    # are never allocated and are returned as None
     # Conversion factor from scfh to metric tons per day
     scfh_to_metric_tons_per_day = 24 * p_gas
 
@@ -16,47 +103,65 @@ def simulate_emissions_optimized(PC_count, DTF, S0, timesteps, p_gas, S1, p, r,
     p = np.clip(p, 0, 1)
     r = np.clip(r, 0, 1)
 
-    # Sample PC-specific emission rates
-    prop_sample = np.random.choice(prop_rates, size=PC_count)
-    malf_sample = np.random.choice(malf_rates, size=PC_count)
+    rng = np.random.default_rng(rng)
+
+    # Sample PC-specific emission rates (with replacement, by index)
+    prop_sample = prop_rates[rng.integers(0, len(prop_rates), size=PC_count)]
+    malf_sample = malf_rates[rng.integers(0, len(malf_rates), size=PC_count)]
 
     # Initial states: 0 = properly operating, 1 = malfunctioning
-    states = np.random.choice([0, 1], size=PC_count, p=[S0, S1])
+    states = (rng.random(PC_count) >= S0).astype(np.int8)
 
-    # Preallocate output arrays
-    emission_rates_each = np.zeros((timesteps, PC_count))
+    # Preallocate output arrays; per-PC histories only hold 0/1 states and SCFH rates,
+    # so narrow dtypes cut their memory traffic
+    history_shape = (timesteps, PC_count) if full_output else (0, 0)
+    emission_rates_each = np.zeros(history_shape, dtype=np.float32)
     state_history = np.zeros((timesteps, 2))
-    state_history_each = np.zeros((timesteps, PC_count))
+    state_history_each = np.zeros(history_shape, dtype=np.int8)
+    sum_emission_rate = np.zeros(timesteps)
 
-    # Transition matrix
-    P = np.array([[1 - p, p],
-                  [r, 1 - r]])
+    # The jitted loop draws from rng's own stream; rng must stay alive (it does, it's a local) and
+    # must not be used elsewhere while the loop holds its raw state
+    bitgen = rng.bit_generator.ctypes
+    _simulate_core(bitgen.next_double, bitgen.state_address, states, prop_sample, malf_sample, p, r, timesteps, full_output,
+                   sum_emission_rate, emission_rates_each, state_history, state_history_each)
 
-    for t in range(timesteps):
-        # Record current states
-        state_history_each[t] = states
-        state_counts = np.bincount(states, minlength=2) / PC_count
-        state_history[t] = state_counts
-
-        # Assign emission rates for this timestep
-        emissions = np.where(states == 0, prop_sample, malf_sample)
-        emission_rates_each[t] = emissions
-
-        # Transition: use random values and threshold logic for faster state updates
-        rand_vals = np.random.rand(PC_count)
-        next_states = np.where(
-            (states == 0) & (rand_vals < p), 1,
-            np.where((states == 1) & (rand_vals < r), 0, states)
-        )
-        states = next_states
-
-    # Emission summaries
-    avg_emission_rate = np.mean(emission_rates_each, axis=1)
+    # Emission summaries; per-step sums are accumulated in float64 by the loop, mean = sum / N
+    avg_emission_rate = sum_emission_rate * (1.0 / PC_count)
     all_avg_emission_rate = np.mean(avg_emission_rate)
-    sum_emission_rate = np.sum(emission_rates_each, axis=1)
     cumulative_emission = np.cumsum(sum_emission_rate) * scfh_to_metric_tons_per_day
     final_cumulative_emission = cumulative_emission[-1]
 
+    if not full_output:
+        emission_rates_each = state_history_each = None
+
     return (emission_rates_each, avg_emission_rate, all_avg_emission_rate,
             sum_emission_rate, cumulative_emission, final_cumulative_emission,
             state_history, state_history_each)
+
+
+def run_monte_carlo(run_seeds, DTF_arr, S0_arr, PC_count, timesteps, p_gas, prop_rates, malf_rates):
+    """Simulate one run per seed and DTF/S0 pair, returning (mc_avg, mc_final, p, r, results).
+
+    Every run contributes its average emission rate and final cumulative emission to mc_avg and
+    mc_final. Only the last run keeps its per-PC histories; its p, r and full results are returned
+    for plotting.
+    """
+    MC_runs = len(run_seeds)
+    mc_avg = np.empty(MC_runs)
+    mc_final = np.empty(MC_runs)
+
+    for k, seed in enumerate(run_seeds):
+        # Transition probabilities that hold S0 as the steady-state properly operating portion
+        DTF, S0 = DTF_arr[k], S0_arr[k]
+        S1 = 1 - S0
+        p = S0 / DTF
+        r = (p / S1) - p
+
+        results = simulate_emissions_optimized(
+            PC_count, DTF, S0, timesteps, p_gas, S1, p, r, prop_rates, malf_rates,
+            rng=np.random.default_rng(seed), full_output=(k == MC_runs - 1))
+        mc_avg[k] = results[2]
+        mc_final[k] = results[5]
+
+    return mc_avg, mc_final, p, r, results
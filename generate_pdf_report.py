@@ -5,6 +5,8 @@ from matplotlib.backends.backend_pdf import PdfPages
 from io import BytesIO
 import numpy as np
 import os
+import threading
+from functools import lru_cache
 from PIL import Image
 
 
@@ -16,6 +18,53 @@ def wrap_list(label, values, wrap=10):
     return lines
 
 
+LOGO_PATH = os.path.join(os.path.dirname(__file__), "eemdl_logo.png")
+
+
+@lru_cache(maxsize=4)
+def load_logo(logo_path, dpi, logo_width_inch=1.5):
+    """Load the logo resized to the given width as a read-only RGBA float array, cached across pages.
+
+    The resized array is baked to a .npy file beside the PNG the first time, so later processes
+    memory-map it instead of decoding and resizing the PNG again.
+    """
+    logo_width_px = int(logo_width_inch * dpi)
+    baked_path = f"{os.path.splitext(logo_path)[0]}_{int(dpi)}_{logo_width_px}.npy"
+    if os.path.exists(baked_path) and os.path.getmtime(baked_path) >= os.path.getmtime(logo_path):
+        try:
+            return np.load(baked_path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            # Unreadable or truncated bake: fall through and rebuild it
+            print(f"Rebuilding cached logo: {e}")
+
+    logo = Image.open(logo_path).convert("RGBA")
+    scale = logo_width_px / logo.width
+    logo_resized = logo.resize((logo_width_px, int(logo.height * scale)), Image.LANCZOS)
+    logo_arr = np.array(logo_resized) / 255.0
+    # Write to a temp file unique to this process and thread, then swap it in, so concurrent bakes never
+    # expose a partial file. Plain open() keeps the usual umask-based mode, so other users can read the bake
+    tmp_path = f"{baked_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, logo_arr)
+        os.replace(tmp_path, baked_path)
+    except OSError as e:
+        print(f"Could not cache resized logo: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # Shared by every caller through the cache, so keep it read-only
+    logo_arr.setflags(write=False)
+    return logo_arr
+
+
+# Bake the logo for the default figure dpi up front
+if os.path.exists(LOGO_PATH):
+    try:
+        load_logo(LOGO_PATH, plt.rcParams['figure.dpi'])
+    except (OSError, ValueError) as e:
+        print(f"Error loading logo: {e}")
+
+
 def add_branded_elements(fig, page_num):
     """Add top-centered logo and bottom footer to a figure."""
     fig_width, fig_height = fig.get_size_inches()
@@ -25,15 +74,9 @@ def add_branded_elements(fig, page_num):
     fig.text(0.5, 0.02, footer_text, ha='center', fontsize=8, color='gray')
     fig.text(0.98, 0.02, f"Page {page_num}", ha='right', fontsize=8, color='gray')
 
-    logo_path = os.path.join(os.path.dirname(__file__), "eemdl_logo.png")
-    if os.path.exists(logo_path):
+    if os.path.exists(LOGO_PATH):
         try:
-            logo = Image.open(logo_path).convert("RGBA")
-            logo_width_inch = 1.5
-            logo_width_px = int(logo_width_inch * dpi)
-            scale = logo_width_px / logo.width
-            logo_resized = logo.resize((logo_width_px, int(logo.height * scale)), Image.LANCZOS)
-            logo_arr = np.array(logo_resized) / 255.0
+            logo_arr = load_logo(LOGO_PATH, dpi)
 
             xo = int((fig_width * dpi - logo_arr.shape[1]) / 2)
             yo = int(fig_height * dpi - logo_arr.shape[0] - 15)
@@ -43,6 +86,15 @@ def add_branded_elements(fig, page_num):
             print(f"Error rendering logo: {e}")
 
 
+def text_page(text, page_num, **text_kwargs):
+    """Build a branded A4 page holding a single block of monospace text."""
+    fig = plt.figure(figsize=(8.27, 11.69))  # A4 size
+    plt.axis('off')
+    fig.text(0.05, 0.95, text, va='top', ha='left', family='monospace', **text_kwargs)
+    add_branded_elements(fig, page_num)
+    return fig
+
+
 def generate_pdf_report(figs, summary_text, prop_rates, malf_rates):
     """Generates a multipage PDF report with branding and visual layout."""
     pdf_buffer = BytesIO()
@@ -57,11 +109,8 @@ def generate_pdf_report(figs, summary_text, prop_rates, malf_rates):
             page_counter += 1
 
         # --- Page: Summary Text (A4) ---
-        summary_fig = plt.figure(figsize=(8.27, 11.69))  # A4 size
-        plt.axis('off')
-        for i, line in enumerate(summary_text.strip().split('\n')):
-            plt.text(0.05, 0.95 - i * 0.03, line, va='top', fontsize=10, family='monospace')
-        add_branded_elements(summary_fig, page_counter)
+        # One text artist for the whole block; linespacing keeps the original 0.03 pitch
+        summary_fig = text_page(summary_text.strip(), page_counter, fontsize=10, linespacing=2.5)
         pdf.savefig(summary_fig)
         plt.close(summary_fig)
         page_counter += 1
@@ -70,14 +119,11 @@ def generate_pdf_report(figs, summary_text, prop_rates, malf_rates):
         for label, values in [("Properly Operating Rates", prop_rates),
                               ("Malfunctioning Rates", malf_rates)]:
             lines = wrap_list(label, values)
-            lines_per_page = 80
+            # As many lines as fit between the top margin and the footer
+            lines_per_page = 60
             for i in range(0, len(lines), lines_per_page):
                 chunk = lines[i:i + lines_per_page]
-                list_fig = plt.figure(figsize=(8.27, 11.69))  # A4 size
-                plt.axis('off')
-                for j, line in enumerate(chunk):
-                    plt.text(0.05, 0.95 - j * 0.025, line, va='top', fontsize=9, family='monospace')
-                add_branded_elements(list_fig, page_counter)
+                list_fig = text_page("\n".join(chunk), page_counter, fontsize=9, linespacing=1.25)
                 pdf.savefig(list_fig)
                 plt.close(list_fig)
                 page_counter += 1
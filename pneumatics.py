@@ -1,20 +1,66 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
 import json
+import csv
+import hashlib
+import os
 from datetime import datetime
 import matplotlib.pyplot as plt
-from PC_Emissions_Sim import simulate_emissions_optimized as simulate_emissions
+from matplotlib.collections import LineCollection
+from PC_Emissions_Sim import run_monte_carlo
 from generate_pdf_report import generate_pdf_report
 
-from io import BytesIO
+from io import BytesIO, StringIO
 
 from PIL import Image
 import base64
 
-# Encode logo as base64 to embed in HTML
-with open("eemdl_logo.png", "rb") as image_file:
-    encoded_logo = base64.b64encode(image_file.read()).decode()
+# Encode logo as base64 to embed in HTML, once per session rather than every rerun
+@st.cache_data
+def encode_logo(path):
+    with open(path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode()
+
+encoded_logo = encode_logo("eemdl_logo.png")
+
+# Parse rate CSVs (first column, header row skipped) once per distinct file rather than every rerun
+@st.cache_data(show_spinner=False)
+def load_rates_csv(csv_bytes):
+    reader = csv.reader(StringIO(csv_bytes.decode("utf-8-sig")))
+    next(reader, None)
+    rates = []
+    for row_num, row in enumerate(reader, start=2):
+        # Blank cells are skipped like dropna(); anything else must parse, so bad uploads reach st.error
+        cell = row[0].strip() if row else ""
+        if not cell:
+            continue
+        try:
+            rates.append(float(cell))
+        except ValueError:
+            raise ValueError(f"Row {row_num}: could not parse rate {row[0]!r}") from None
+    rates = np.array(rates, dtype=np.float64)
+    return rates[~np.isnan(rates)]
+
+@st.cache_data(show_spinner=False)
+def load_default_rates_csv(path, mtime):
+    # mtime only keys the cache, so edits to the bundled file are picked up
+    with open(path, "rb") as f:
+        return load_rates_csv(f.read())
+
+def array_digest(a):
+    # Dtype and shape go into the digest too, so arrays that merely share their bytes get distinct keys
+    digest = hashlib.blake2b(repr((a.dtype.str, a.shape)).encode())
+    digest.update(a.tobytes())
+    return digest.digest()
+
+# Render a figure to PNG once per distinct set of plotted data; arrays are keyed on a digest of all their bytes.
+# Unpinned runs never repeat, so only the last couple of presses' PNGs are kept
+@st.cache_data(show_spinner=False, max_entries=6, hash_funcs={np.ndarray: array_digest})
+def figure_png(_fig, name, *plotted_data):
+    png_buffer = BytesIO()
+    # Same settings st.pyplot uses
+    _fig.savefig(png_buffer, format="png", bbox_inches="tight", dpi=200)
+    return png_buffer.getvalue()
 
 st.markdown(f"""
     <div style='display: flex; align-items: center;'>
@@ -24,97 +70,134 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 st.markdown("<hr style='margin-top:0'>", unsafe_allow_html=True)
 
-# --- Sidebar: Input Format Selection ---
-st.sidebar.title("Simulation Input Options")
-
-# --- Sidebar Simulation Settings ---
-PC_count = st.sidebar.number_input("Number of Pneumatics [1-1,000]", min_value=1, max_value=1000, value=100)
-S0_mean = st.sidebar.slider("Initial Properly Operating Population [0-100%]", 0, 100, 82, 1)/100
-S0_variation = st.sidebar.slider("Variation in Initial Properly Operating Population [±0-100%]", 0, 100, 10, 1)/100
-DTF_min = st.sidebar.number_input("Minimum Number Days to Failure", min_value=1, max_value=90, value=7)
-DTF_max = st.sidebar.number_input("Maximum Number Days to Failure", min_value=91, max_value=365, value=180)
-
-today = datetime.today().strftime("%Y-%m-%d")
-rounded_S0_mean = int(round(S0_mean * 100))
-default_filename = f"PC_Sim_Report_{today}_{PC_count}PCs_{rounded_S0_mean}percent.pdf"
-output_filename = st.sidebar.text_input("Output PDF Filename", value=default_filename)
-
 # --- Simulation Parameters ---
 timesteps = 365
 p_gas = 0.0000192
 MC_runs = 100
 
-S0_min = max(0.0, S0_mean - S0_variation)
-S0_max = min(1.0, S0_mean + S0_variation)
 
-file_format = st.sidebar.radio("Choose Input Format:", options=["Separate CSV Files", "JSON File"])
+# --- Sidebar ---
+# A fragment, so slider drags and uploads rerun only the sidebar; the settings are
+# handed to the simulation panel through st.session_state
+@st.fragment
+def sidebar_inputs():
+    # --- Sidebar: Input Format Selection ---
+    st.title("Simulation Input Options")
 
-# --- Show Download and Upload Widgets Based on Format ---
-prop_file = malf_file = json_file = None
+    # --- Sidebar Simulation Settings ---
+    PC_count = st.number_input("Number of Pneumatics [1-1,000]", min_value=1, max_value=1000, value=100)
+    S0_mean = st.slider("Initial Properly Operating Population [0-100%]", 0, 100, 82, 1)/100
+    S0_variation = st.slider("Variation in Initial Properly Operating Population [±0-100%]", 0, 100, 10, 1)/100
+    DTF_min = st.number_input("Minimum Number Days to Failure", min_value=1, max_value=90, value=7)
+    DTF_max = st.number_input("Maximum Number Days to Failure", min_value=91, max_value=365, value=180)
 
-if file_format == "Separate CSV Files":
-    st.sidebar.markdown("### 📅 Download Default CSV Files")
-    st.sidebar.download_button("Download Prop Rates CSV", open("final_prop_rates.csv", "rb"), file_name="final_prop_rates.csv")
-    st.sidebar.download_button("Download Malf Rates CSV", open("final_malf_rates.csv", "rb"), file_name="final_malf_rates.csv")
-    st.sidebar.markdown("### 📤 Upload Your Own CSVs")
-    prop_file = st.sidebar.file_uploader("Upload Prop Rates CSV", type="csv")
-    malf_file = st.sidebar.file_uploader("Upload Malf Rates CSV", type="csv")
+    today = datetime.today().strftime("%Y-%m-%d")
+    rounded_S0_mean = int(round(S0_mean * 100))
+    default_filename = f"PC_Sim_Report_{today}_{PC_count}PCs_{rounded_S0_mean}percent.pdf"
+    output_filename = st.text_input("Output PDF Filename", value=default_filename)
+    seed = st.number_input("Random Seed (leave blank for a new seed each run)",
+                           min_value=0, max_value=2**32 - 1, value=None, step=1)
 
-elif file_format == "JSON File":
-    st.sidebar.markdown("### 📅 Download Default JSON File")
-    st.sidebar.download_button("Download JSON File", open("final_rates.json", "rb"), file_name="final_rates.json")
-    st.sidebar.markdown("### 📤 Upload Your Own JSON")
-    json_file = st.sidebar.file_uploader("Upload JSON File", type="json")
+    file_format = st.radio("Choose Input Format:", options=["Separate CSV Files", "JSON File"])
 
-# --- Load and Validate Data ---
-prop_rates = malf_rates = None
+    # --- Show Download and Upload Widgets Based on Format ---
+    prop_file = malf_file = json_file = None
 
-try:
     if file_format == "Separate CSV Files":
-        prop_df = pd.read_csv(prop_file) if prop_file else pd.read_csv("final_prop_rates.csv")
-        malf_df = pd.read_csv(malf_file) if malf_file else pd.read_csv("final_malf_rates.csv")
-        prop_rates = prop_df.iloc[:, 0].dropna().to_numpy()
-        malf_rates = malf_df.iloc[:, 0].dropna().to_numpy()
-    elif file_format == "JSON File":
-        if json_file:
-            rates_data = json.load(json_file)
-        else:
-            with open("final_rates.json", "r") as f:
-                rates_data = json.load(f)
-        prop_rates = np.array(rates_data.get("prop_rates", []))
-        malf_rates = np.array(rates_data.get("malf_rates", []))
-except Exception as e:
-    st.error(f"Error loading input files: {e}")
-    st.stop()
-
-if len(prop_rates) == 0 or len(malf_rates) == 0:
-    missing = []
-    if len(prop_rates) == 0: missing.append("Properly Operating Rates")
-    if len(malf_rates) == 0: missing.append("Malfunctioning Rates")
-    st.error(f"Missing or empty input data: {', '.join(missing)}. Please upload valid file(s).")
-    st.stop()
-
-# --- Run Simulation ---
-if st.button("Run Simulation"):
-    DTF_list, S0_list, MC_all_avg_emission_rate, MC_final_cumulative_emission = [], [], [], []
+        st.markdown("### 📅 Download Default CSV Files")
+        st.download_button("Download Prop Rates CSV", open("final_prop_rates.csv", "rb"), file_name="final_prop_rates.csv")
+        st.download_button("Download Malf Rates CSV", open("final_malf_rates.csv", "rb"), file_name="final_malf_rates.csv")
+        st.markdown("### 📤 Upload Your Own CSVs")
+        prop_file = st.file_uploader("Upload Prop Rates CSV", type="csv")
+        malf_file = st.file_uploader("Upload Malf Rates CSV", type="csv")
 
-    for _ in range(MC_runs):
-        DTF = np.random.randint(DTF_min, DTF_max + 1)
-        DTF = max(1, DTF)
-        S0 = np.random.uniform(S0_min, S0_max)
-        S1 = 1 - S0
-        p = S0 / DTF
-        r = (p / S1) - p
-
-        DTF_list.append(DTF)
-        S0_list.append(S0)
+    elif file_format == "JSON File":
+        st.markdown("### 📅 Download Default JSON File")
+        st.download_button("Download JSON File", open("final_rates.json", "rb"), file_name="final_rates.json")
+        st.markdown("### 📤 Upload Your Own JSON")
+        json_file = st.file_uploader("Upload JSON File", type="json")
+
+    st.session_state.sim_inputs = dict(
+        PC_count=PC_count, S0_mean=S0_mean, S0_variation=S0_variation,
+        S0_min=max(0.0, S0_mean - S0_variation), S0_max=min(1.0, S0_mean + S0_variation),
+        DTF_min=DTF_min, DTF_max=DTF_max, output_filename=output_filename, seed=seed,
+        file_format=file_format, prop_file=prop_file, malf_file=malf_file, json_file=json_file)
+
+
+def load_rates(file_format, prop_file, malf_file, json_file):
+    """Load and validate the rate arrays, reporting problems with st.error; returns None on failure."""
+    prop_rates = malf_rates = None
+
+    try:
+        if file_format == "Separate CSV Files":
+            prop_rates = (load_rates_csv(prop_file.getvalue()) if prop_file else
+                          load_default_rates_csv("final_prop_rates.csv", os.path.getmtime("final_prop_rates.csv")))
+            malf_rates = (load_rates_csv(malf_file.getvalue()) if malf_file else
+                          load_default_rates_csv("final_malf_rates.csv", os.path.getmtime("final_malf_rates.csv")))
+        elif file_format == "JSON File":
+            if json_file:
+                # getvalue rather than read: the upload object persists across fragment reruns
+                rates_data = json.loads(json_file.getvalue())
+            else:
+                with open("final_rates.json", "r") as f:
+                    rates_data = json.load(f)
+            prop_rates = np.array(rates_data.get("prop_rates", []))
+            malf_rates = np.array(rates_data.get("malf_rates", []))
+    except Exception as e:
+        st.error(f"Error loading input files: {e}")
+        return None
+
+    if len(prop_rates) == 0 or len(malf_rates) == 0:
+        missing = []
+        if len(prop_rates) == 0: missing.append("Properly Operating Rates")
+        if len(malf_rates) == 0: missing.append("Malfunctioning Rates")
+        st.error(f"Missing or empty input data: {', '.join(missing)}. Please upload valid file(s).")
+        return None
+
+    return prop_rates, malf_rates
+
+
+with st.sidebar:
+    sidebar_inputs()
 
-        (emission_rates_each, avg_emission_rate, all_avg_emission_rate, sum_emission_rate, cumulative_emission,
-         final_cumulative_emission, state_history, state_history_each) = simulate_emissions(
-            PC_count, DTF, S0, timesteps, p_gas, S1, p, r, prop_rates, malf_rates)
 
-        MC_all_avg_emission_rate.append(all_avg_emission_rate)
-        MC_final_cumulative_emission.append(final_cumulative_emission)
+# --- Run Simulation ---
+# Its own fragment, so the results panel only re-renders when the button is pressed
+@st.fragment
+def simulation_panel():
+    if not st.button("Run Simulation"):
+        return
+
+    inputs = st.session_state.sim_inputs
+    PC_count, S0_mean, S0_variation = inputs["PC_count"], inputs["S0_mean"], inputs["S0_variation"]
+    S0_min, S0_max = inputs["S0_min"], inputs["S0_max"]
+    DTF_min, DTF_max = inputs["DTF_min"], inputs["DTF_max"]
+    output_filename = inputs["output_filename"]
+
+    # --- Load and Validate Data ---
+    rates = load_rates(inputs["file_format"], inputs["prop_file"], inputs["malf_file"], inputs["json_file"])
+    if rates is None:
+        return
+    prop_rates, malf_rates = rates
+
+    # One independent child stream per run, all derived from a single seed. Unpinned runs draw
+    # a fresh seed small enough to type back into the sidebar, and the report records it
+    seed = inputs["seed"] if inputs["seed"] is not None else int(np.random.SeedSequence().entropy % 2**32)
+    seed_seq = np.random.SeedSequence(seed)
+    param_seed, *run_seeds = seed_seq.spawn(1 + MC_runs)
+
+    # Sample every run's parameters up front
+    param_rng = np.random.default_rng(param_seed)
+    DTF_arr = np.maximum(1, param_rng.integers(DTF_min, DTF_max + 1, size=MC_runs))
+    S0_arr = param_rng.uniform(S0_min, S0_max, size=MC_runs)
+
+    # Runs execute in-process: 1,000 PCs x 100 runs take under 0.1 s in the jitted loop, less than
+    # starting worker processes would. The last run feeds the plots and keeps its full arrays
+    mc_avg, mc_final, p, r, plot_results = run_monte_carlo(run_seeds, DTF_arr, S0_arr, PC_count, timesteps, p_gas,
+                                                           prop_rates, malf_rates)
+
+    (emission_rates_each, avg_emission_rate, all_avg_emission_rate, sum_emission_rate, cumulative_emission,
+     final_cumulative_emission, state_history, state_history_each) = plot_results
 
     # --- Create and Display Split Figures ---
     height_ratio_factor = max(6, PC_count / 100)
@@ -129,16 +212,24 @@ if st.button("Run Simulation"):
     axs1[0].legend()
     axs1[0].grid(True)
 
-    for i in range(min(100, PC_count)):
-        axs1[1].plot(range(timesteps), state_history_each[:, i] + i * 1.5, 'k-', alpha=0.7)
+    # One LineCollection per panel instead of one Line2D per PC; segments are (n_traces, timesteps, xy)
+    time_axis = np.arange(timesteps)
+    n_state_traces = min(100, PC_count)
+    state_traces = state_history_each[:, :n_state_traces].T + np.arange(n_state_traces)[:, None] * 1.5
+    axs1[1].add_collection(LineCollection(np.stack(np.broadcast_arrays(time_axis, state_traces), axis=-1),
+                                          colors='k', alpha=0.7))
+    axs1[1].autoscale_view()
     axs1[1].set_title("Individual PC States Over Time")
     axs1[1].grid(True)
 
     # Page 2: Subplots 2–4
-    fig2, axs2 = plt.subplots(3, 1, figsize=(8.27, 11.69), height_ratios=[4, 2, 2])
+    # dpi sets the resolution of the rasterized trace layer in the PDF
+    fig2, axs2 = plt.subplots(3, 1, figsize=(8.27, 11.69), height_ratios=[4, 2, 2], dpi=150)
     fig2.subplots_adjust(hspace=0.4)
-    for i in range(PC_count):
-        axs2[0].plot(range(timesteps), emission_rates_each[:, i], 'k-', alpha=0.2)
+    # Up to PC_count overlapping traces: embed them as an image, keep axes and the average line as vectors
+    axs2[0].add_collection(LineCollection(np.stack(np.broadcast_arrays(time_axis, emission_rates_each.T), axis=-1),
+                                          colors='k', alpha=0.2, rasterized=True))
+    axs2[0].autoscale_view()
     axs2[0].plot(range(timesteps), avg_emission_rate, 'r-', linewidth=2, label="Avg Emission")
     axs2[0].set_title("Emission Rates Over Time")
     axs2[0].legend()
@@ -152,11 +243,11 @@ if st.button("Run Simulation"):
     ax_secondary.tick_params(axis='y', labelcolor='b')
 
     ax4 = axs2[2]
-    bp1 = ax4.boxplot([MC_final_cumulative_emission], vert=True, patch_artist=True, positions=[1])
+    bp1 = ax4.boxplot([mc_final], vert=True, patch_artist=True, positions=[1])
     for patch in bp1['boxes']: patch.set_facecolor("#1f77b4")
     ax4.set_ylabel("Annual Emissions (metric tons)", color="#1f77b4")
     ax_dtf = ax4.twinx()
-    bp2 = ax_dtf.boxplot([DTF_list], vert=True, patch_artist=True, positions=[2])
+    bp2 = ax_dtf.boxplot([DTF_arr], vert=True, patch_artist=True, positions=[2])
     for patch in bp2['boxes']: patch.set_facecolor("#ff7f0e")
     ax_dtf.set_ylabel("Days to Failure (DTF)", color="#ff7f0e")
 
@@ -164,11 +255,11 @@ if st.button("Run Simulation"):
     fig3, axs3 = plt.subplots(4, 1, figsize=(8.27, 11.69), height_ratios=[3, 3, 3, 3])
     fig3.subplots_adjust(hspace=0.4)
 
-    axs3[0].scatter(DTF_list, MC_final_cumulative_emission, alpha=0.6, color='blue', edgecolor='black')
+    axs3[0].scatter(DTF_arr, mc_final, alpha=0.6, color='blue', edgecolor='black')
     axs3[0].set_title("DTF vs Cumulative Emissions")
     axs3[0].grid(True)
 
-    axs3[1].scatter(S0_list, MC_final_cumulative_emission, alpha=0.6, color='orange', edgecolor='black')
+    axs3[1].scatter(S0_arr, mc_final, alpha=0.6, color='orange', edgecolor='black')
     axs3[1].set_title("Properly Operating Portion vs Cumulative Emissions")
     axs3[1].grid(True)
 
@@ -184,18 +275,20 @@ if st.button("Run Simulation"):
     axs3[3].set_ylabel("Frequency")
     axs3[3].grid(True)
 
-    st.pyplot(fig1)
-    st.pyplot(fig2)
-    st.pyplot(fig3)
+    st.image(figure_png(fig1, "states", state_history, state_history_each[:, :min(100, PC_count)], p, r))
+    st.image(figure_png(fig2, "emissions", emission_rates_each, avg_emission_rate, sum_emission_rate,
+                        cumulative_emission, mc_final, DTF_arr))
+    st.image(figure_png(fig3, "distributions", DTF_arr, S0_arr, mc_final,
+                        prop_rates, malf_rates))
 
-    mean_avg_emission = np.mean(MC_all_avg_emission_rate)
-    std_avg_emission = np.std(MC_all_avg_emission_rate)
-    mean_cum_emission = np.mean(MC_final_cumulative_emission)
-    std_cum_emission = np.std(MC_final_cumulative_emission)
-    mean_S0 = np.mean(S0_list)
-    std_S0 = np.std(S0_list)
+    mean_avg_emission = mc_avg.mean()
+    std_avg_emission = mc_avg.std()
+    mean_cum_emission = mc_final.mean()
+    std_cum_emission = mc_final.std()
+    mean_S0 = S0_arr.mean()
+    std_S0 = S0_arr.std()
 
-    summary_text = f"""Simulation Summary\n----------------------------\nDate: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\nInputs\nPneumatics: {PC_count}\nAvg. Properly Operating Portion: {S0_mean*100:.0f}% ± {S0_variation*100:.0f}%\nMonte Carlo Runs: {MC_runs}\nRange of Potential Days to Failure: {DTF_min} to {DTF_max} days\n\nResults\nAvg. Emission Rate Per Controller: {mean_avg_emission:.1f} ± {std_avg_emission:.1f} scfh\nAvg. Emissions Per Controller: {mean_cum_emission / PC_count:.2f} ± {std_cum_emission / PC_count:.2f} metric tons per year\nPopulation Emissions: {mean_cum_emission:.1f} ± {std_cum_emission:.1f} metric tons per year\nAvg. Days to Failure: {np.mean(DTF_list):.0f}\nStd Dev Days to Failure: {np.std(DTF_list):.0f}\nAvg Properly Operating Portion: {mean_S0*100:.0f}%\nStd Dev Properly Operating Portion: {std_S0*100:.0f}%"""
+    summary_text = f"""Simulation Summary\n----------------------------\nDate: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\nInputs\nPneumatics: {PC_count}\nAvg. Properly Operating Portion: {S0_mean*100:.0f}% ± {S0_variation*100:.0f}%\nMonte Carlo Runs: {MC_runs}\nRandom Seed: {seed}\nRange of Potential Days to Failure: {DTF_min} to {DTF_max} days\n\nResults\nAvg. Emission Rate Per Controller: {mean_avg_emission:.1f} ± {std_avg_emission:.1f} scfh\nAvg. Emissions Per Controller: {mean_cum_emission / PC_count:.2f} ± {std_cum_emission / PC_count:.2f} metric tons per year\nPopulation Emissions: {mean_cum_emission:.1f} ± {std_cum_emission:.1f} metric tons per year\nAvg. Days to Failure: {DTF_arr.mean():.0f}\nStd Dev Days to Failure: {DTF_arr.std():.0f}\nAvg Properly Operating Portion: {mean_S0*100:.0f}%\nStd Dev Properly Operating Portion: {std_S0*100:.0f}%"""
 
     st.text(summary_text)
 
@@ -210,3 +303,6 @@ if st.button("Run Simulation"):
 
     st.markdown("<hr>", unsafe_allow_html=True)
     st.markdown("<div style='text-align:center; color:gray;'>Intermittent Bleed Pneumatic Controller Simulator v1.0 | LICENSE PLACEHOLDER</div>", unsafe_allow_html=True)
+
+
+simulation_panel()